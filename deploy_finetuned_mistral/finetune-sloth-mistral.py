@@ -17,16 +17,19 @@ Steps:
 # !pip install --no-deps bitsandbytes accelerate xformers==0.0.29.post3 peft trl==0.15.2 triton cut_cross_entropy unsloth_zoo
 # !pip install sentencepiece protobuf datasets huggingface_hub hf_transfer
 # !pip install --no-deps unsloth
+# !pip install flash-attn --no-build-isolation  # Unsloth dispatches to FlashAttention-2 when installed
 
 from unsloth import FastLanguageModel, is_bfloat16_supported
 from transformers import TrainingArguments
 from trl import SFTTrainer
 from datasets import load_dataset
+from torch.utils.checkpoint import checkpoint
 import torch
+import os
 
 # ------------------ Model Configuration ------------------
 max_seq_length = 2048
-dtype = None  # Auto-detect best dtype for GPU
+dtype = torch.bfloat16 if is_bfloat16_supported() else None  # BF16 enables the FlashAttention-2 path
 load_in_4bit = True  # Memory efficient
 
 model_name = "unsloth/Meta-Llama-3.1-8B"  # Swap out as needed
@@ -45,12 +48,30 @@ model = FastLanguageModel.get_peft_model(
     lora_alpha=16,
     lora_dropout=0,
     bias="none",
-    use_gradient_checkpointing="unsloth",
+    use_gradient_checkpointing=False,  # replaced by MLP-only checkpointing below
     random_state=3407,
     use_rslora=False,
     loftq_config=None,
 )
 
+# ------------------ Gradient Checkpointing ------------------
+# Layer-boundary checkpointing re-runs FlashAttention in backward even though FA
+# already recomputes softmax block-wise. Checkpoint only the MLPs instead, so the
+# attention output is kept and backward only re-forwards the MLP.
+checkpoint_interval = 1  # checkpoint every Nth layer's MLP; 2 trades memory for speed
+
+def checkpoint_mlp(mlp):
+    forward = mlp.forward
+    def checkpointed_forward(hidden_states):
+        if not torch.is_grad_enabled():
+            return forward(hidden_states)
+        return checkpoint(forward, hidden_states, use_reentrant=False)
+    mlp.forward = checkpointed_forward
+
+for i, layer in enumerate(model.get_base_model().model.layers):
+    if i % checkpoint_interval == 0:
+        checkpoint_mlp(layer.mlp)
+
 # ------------------ Prompt Formatting ------------------
 
 alpaca_prompt = """Below is an instruction that describes a task, paired with an input that provides further context. Write a response that appropriately completes the request.
@@ -79,7 +100,20 @@ def formatting_prompts_func(examples):
 # ------------------ Dataset Loading ------------------
 
 dataset = load_dataset("LLukas22/fiqa", split="train")
-dataset = dataset.map(formatting_prompts_func, batched=True)
+dataset = dataset.map(
+    formatting_prompts_func,
+    batched=True,
+    num_proc=os.cpu_count(),
+    remove_columns=dataset.column_names,
+)
+
+# Pre-tokenize once up front so the trainer doesn't re-tokenize on the fly
+dataset = dataset.map(
+    lambda batch: tokenizer(batch["text"], truncation=True, max_length=max_seq_length),
+    batched=True,
+    num_proc=os.cpu_count(),
+    remove_columns=["text"],
+)
 
 # ------------------ Training ------------------
 
@@ -87,10 +121,9 @@ trainer = SFTTrainer(
     model=model,
     tokenizer=tokenizer,
     train_dataset=dataset,
-    dataset_text_field="text",
     max_seq_length=max_seq_length,
-    dataset_num_proc=2,
-    packing=False,
+    dataset_num_proc=os.cpu_count(),
+    packing=True,  # pack short FiQA samples together instead of padding
     args=TrainingArguments(
         per_device_train_batch_size=2,
         gradient_accumulation_steps=4,
@@ -106,6 +139,8 @@ trainer = SFTTrainer(
         seed=3407,
         output_dir="outputs",
         report_to="none",
+        dataloader_num_workers=4,
+        dataloader_pin_memory=True,
     )
 )
 
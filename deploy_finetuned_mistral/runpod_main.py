@@ -5,30 +5,39 @@ Launches a FastAPI server that wraps a fine-tuned Mistral model (via Unsloth).
 The model is loaded with a LoRA adapter for financial question answering (FiQA-style prompts).
 
 Accepts OpenAI-compatible `/v1/chat/completions` POST requests with multi-turn messages.
+Set `"stream": true` to receive tokens as Server-Sent Events while they are generated.
+Concurrent requests are merged by an in-process micro-batcher into one `generate` call.
 
 Install the following dependencies before running:
 - bitsandbytes, accelerate, xformers, peft, trl, triton, cut_cross_entropy, unsloth_zoo
 - sentencepiece, protobuf, datasets, huggingface_hub, hf_transfer
 - unsloth, fastapi, uvicorn
+- flash-attn (optional, enables FlashAttention-2 kernels)
 """
 
 # === Install dependencies before running ===
 # !pip --quiet install --no-deps bitsandbytes accelerate xformers==0.0.29.post3 peft trl==0.15.2 triton cut_cross_entropy unsloth_zoo
 # !pip --quiet install sentencepiece protobuf datasets huggingface_hub hf_transfer
 # !pip --quiet install --no-deps unsloth fastapi uvicorn
+# !pip --quiet install flash-attn --no-build-isolation  # Unsloth dispatches to FlashAttention-2 when installed
 
 # === Imports ===
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
 import torch
 
-from unsloth import FastLanguageModel
-from transformers import AutoTokenizer
+from unsloth import FastLanguageModel, is_bfloat16_supported
+from transformers import AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
 
 # === Model Load Parameters ===
 max_seq_length = 2048
-dtype = None  # auto-detect best precision
+dtype = torch.bfloat16 if is_bfloat16_supported() else None  # BF16 enables the FlashAttention-2 path
 load_in_4bit = True  # reduce memory usage
 
 # === Load base model and tokenizer ===
@@ -43,9 +52,183 @@ model, tokenizer = FastLanguageModel.from_pretrained(
 model.load_adapter("achnew001/fiqa-mistral-7b-lora", adapter_name="default")
 model.eval()
 
+# === Precision Check ===
+# Unsloth builds its 4-bit config as NF4 with double quantization and compute in
+# `dtype`; the static KV cache is allocated in the model dtype. Log both so a
+# deployment that falls back to FP4 weights or an FP32 cache is easy to spot.
+quant_config = model.config.quantization_config
+if not isinstance(quant_config, dict):
+    quant_config = quant_config.to_dict()
+print(
+    f"4-bit quant type: {quant_config.get('bnb_4bit_quant_type')}, "
+    f"double quant: {quant_config.get('bnb_4bit_use_double_quant')}, "
+    f"compute dtype: {quant_config.get('bnb_4bit_compute_dtype')}, "
+    f"KV cache dtype: {model.dtype}"
+)
+
+# === Fast decoding ===
+# Unsloth's inference mode swaps in its fused decode path (bnb-4bit kernels with
+# its own KV-cache handling). torch.compile / StaticCache are not used: Dynamo
+# cannot trace the bitsandbytes ctypes kernels, and Unsloth's decode path expects
+# tuple caches rather than a StaticCache.
+FastLanguageModel.for_inference(model)
+
+# Requests may ask for at most MAX_NEW_TOKENS; prompts are truncated so that
+# prompt plus new tokens always fits within max_seq_length
+MAX_NEW_TOKENS = 256
+MAX_PROMPT_LENGTH = max_seq_length - MAX_NEW_TOKENS
+
+# === Micro-batching ===
+# Requests arriving within BATCH_WINDOW_MS are merged into one generate call
+# of up to MAX_BATCH rows, left-padded to the longest prompt.
+MAX_BATCH = 8
+BATCH_WINDOW_MS = 8
+
+# Warm-up and every generate call run on this single dedicated thread, so GPU
+# work is serialized and never competes with the event loop
+generation_thread = ThreadPoolExecutor(max_workers=1)
+
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+tokenizer.padding_side = "left"
+tokenizer.truncation_side = "left"  # keep the trailing "### Response:" marker
+
+PROMPT_PREFIX = (
+    "Below is an instruction that describes a task, paired with an input that provides further context. "
+    "Write a response in a helpful, polite, and conversational tone.\n\n"
+    "### Instruction:\nYou are a friendly and knowledgeable financial assistant. Respond with clarity and kindness.\n\n"
+    "### Input:\n"
+)
+
+def tokenize_prompts(prompts):
+    return tokenizer(
+        prompts, padding="longest", max_length=MAX_PROMPT_LENGTH, truncation=True, return_tensors="pt"
+    ).to("cuda")
+
+class RowLimits(StoppingCriteria):
+    """Marks each batch row finished once it has generated its own token limit."""
+
+    def __init__(self, prompt_length, limits):
+        self.prompt_length = prompt_length
+        self.limits = torch.tensor(limits, device="cuda")
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return (input_ids.shape[-1] - self.prompt_length) >= self.limits
+
+class BatchStreamer(BaseStreamer):
+    """Routes each batch row's newly decoded text to that request's asyncio queue."""
+
+    def __init__(self, sinks, limits, loop):
+        self.sinks = sinks
+        self.limits = limits
+        self.loop = loop
+        self.tokens = [[] for _ in sinks]
+        self.sent = [0] * len(sinks)
+        self.prompt_done = False
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are not streamed
+        if not self.prompt_done:
+            self.prompt_done = True
+            return
+        for i, token in enumerate(value.tolist()):
+            sink = self.sinks[i]
+            if sink is None:
+                continue
+            finished = token == tokenizer.eos_token_id
+            if not finished:
+                self.tokens[i].append(token)
+                text = tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+                # Hold back incomplete multi-byte characters until the next token
+                if not text.endswith("\ufffd") and len(text) > self.sent[i]:
+                    self.loop.call_soon_threadsafe(sink.put_nowait, text[self.sent[i]:])
+                    self.sent[i] = len(text)
+            # Close this row's stream as soon as it is done, not when the batch is
+            if finished or len(self.tokens[i]) >= self.limits[i]:
+                self.loop.call_soon_threadsafe(sink.put_nowait, None)
+                self.sinks[i] = None
+
+    def end(self):
+        for sink in self.sinks:
+            if sink is not None:
+                self.loop.call_soon_threadsafe(sink.put_nowait, None)
+
+def generate_batch(prompts, temperature, limits, sinks=None, loop=None):
+    inputs = tokenize_prompts(prompts)
+
+    streamer = None
+    if sinks is not None and any(sink is not None for sink in sinks):
+        streamer = BatchStreamer(sinks, limits, loop)
+
+    if temperature != 0:
+        sampling = dict(do_sample=True, temperature=temperature, top_p=0.95)
+    else:
+        sampling = dict(do_sample=False)
+
+    outputs = model.generate(
+        **inputs,
+        **sampling,
+        use_cache=True,
+        max_new_tokens=max(limits),
+        stopping_criteria=StoppingCriteriaList([RowLimits(inputs.input_ids.shape[-1], limits)]),
+        streamer=streamer,
+    )
+
+    # Decode only the newly generated tokens, trimmed to each request's max_tokens
+    new_tokens = outputs[:, inputs.input_ids.shape[-1]:]
+    return [
+        tokenizer.decode(tokens[:limit], skip_special_tokens=True).strip()
+        for tokens, limit in zip(new_tokens, limits)
+    ]
+
+async def batcher(queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_MS / 1000
+        while len(pending) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Sampling temperature is per call, so only equal temperatures share a batch
+        groups = {}
+        for item in pending:
+            groups.setdefault(item[1], []).append(item)
+
+        for temperature, group in groups.items():
+            prompts, _, limits, futures, sinks = (list(x) for x in zip(*group))
+            try:
+                texts = await loop.run_in_executor(
+                    generation_thread, generate_batch, prompts, temperature, limits, sinks, loop
+                )
+                for future, text in zip(futures, texts):
+                    if future is not None and not future.done():
+                        future.set_result(text)
+            except Exception as e:
+                # Non-streaming requests await their future; streaming ones read the error from the sink
+                for future, sink in zip(futures, sinks):
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                    if sink is not None:
+                        sink.put_nowait(e)
+
+# Warm up once on the generation thread so CUDA/cuBLAS initialization isn't paid
+# by the first real request
+generation_thread.submit(generate_batch, [PROMPT_PREFIX], 0, [8]).result()
+
 # === FastAPI Setup ===
 app = FastAPI()
 
+@app.on_event("startup")
+async def start_batcher():
+    app.state.queue = asyncio.Queue()
+    app.state.batcher = asyncio.create_task(batcher(app.state.queue))
+
 # === Request Models ===
 class Message(BaseModel):
     role: str
@@ -56,6 +239,7 @@ class ChatRequest(BaseModel):
     messages: List[Message]
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 256
+    stream: Optional[bool] = False
 
 # === Chat Endpoint ===
 @app.post("/v1/chat/completions")
@@ -64,27 +248,21 @@ async def chat(request: ChatRequest):
     conversation = ""
     for m in request.messages:
         if m.role == "user":
-            conversation += (
-                "Below is an instruction that describes a task, paired with an input that provides further context. "
-                "Write a response in a helpful, polite, and conversational tone.\n\n"
-                "### Instruction:\nYou are a friendly and knowledgeable financial assistant. Respond with clarity and kindness.\n\n"
-                f"### Input:\n{m.content}\n\n"
-                "### Response:\n"
-            )
-
-    # Tokenize and generate
-    inputs = tokenizer(conversation, return_tensors="pt").to("cuda")
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=request.max_tokens,
-        temperature=request.temperature,
-        top_p=0.95,
-        do_sample=True,
-    )
+            conversation += PROMPT_PREFIX + f"{m.content}\n\n### Response:\n"
+
+    # Hand the prompt to the batcher; non-streaming requests wait on a future,
+    # streaming ones read text deltas from a queue
+    future = None if request.stream else asyncio.get_running_loop().create_future()
+    sink = asyncio.Queue() if request.stream else None
+    max_tokens = min(request.max_tokens or MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+    # An explicit null falls back to the default; 0 still means greedy decoding
+    temperature = 0.7 if request.temperature is None else request.temperature
+    await app.state.queue.put((conversation, temperature, max_tokens, future, sink))
 
-    # Post-process response
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    cleaned = response.split("### Response:")[-1].strip()
+    if request.stream:
+        return stream_chat(request, sink)
+
+    cleaned = await future
 
     # Return OpenAI-compatible format
     return {
@@ -100,3 +278,28 @@ async def chat(request: ChatRequest):
             "finish_reason": "stop"
         }]
     }
+
+# === Streaming Response ===
+def stream_chat(request, sink):
+    def chunk(delta, finish_reason=None):
+        payload = {
+            "id": "chatcmpl-001",
+            "object": "chat.completion.chunk",
+            "model": request.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    # The batcher's streamer pushes text deltas into the sink, then None when done,
+    # or the exception if generation failed
+    async def events():
+        yield chunk({"role": "assistant"})
+        while (item := await sink.get()) is not None:
+            if isinstance(item, Exception):
+                yield f"data: {json.dumps({'error': {'message': str(item), 'type': 'server_error'}})}\n\n"
+                return
+            yield chunk({"content": item})
+        yield chunk({}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
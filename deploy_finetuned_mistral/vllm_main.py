@@ -0,0 +1,148 @@
+"""
+vllm_main.py – vLLM Inference API for FinWise Financial Assistant
+
+Drop-in alternative to runpod_main.py that serves the same fine-tuned LoRA adapter
+through vLLM's AsyncLLMEngine instead of a single `model.generate` call per request.
+vLLM continuously batches concurrent requests and keeps the KV cache in paged blocks,
+so throughput scales with load instead of serializing on one generate call.
+
+Exposes the same OpenAI-compatible `/v1/chat/completions` POST endpoint, including
+`"stream": true` for Server-Sent Events.
+
+Install the following dependencies before running:
+- vllm, fastapi, uvicorn, huggingface_hub
+
+Run with:
+    uvicorn vllm_main:app --host 0.0.0.0 --port 8000
+
+Alternatively, LoRAX serves the adapter with no Python wrapper at all:
+    docker run --gpus all -p 8000:80 ghcr.io/predibase/lorax:latest \
+        --model-id unsloth/mistral-7b-instruct-v0.3 --adapter-id achnew001/fiqa-mistral-7b-lora
+"""
+
+# === Install dependencies before running ===
+# !pip --quiet install vllm fastapi uvicorn huggingface_hub
+
+# === Imports ===
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import json
+import uuid
+
+from huggingface_hub import snapshot_download
+from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+from vllm.lora.request import LoRARequest
+
+# === Engine Parameters ===
+max_seq_length = 2048
+
+# === Load base model with LoRA support ===
+engine = AsyncLLMEngine.from_engine_args(
+    AsyncEngineArgs(
+        model="unsloth/mistral-7b-instruct-v0.3",
+        max_model_len=max_seq_length,
+        dtype="bfloat16",
+        enable_lora=True,
+        max_lora_rank=16,
+        enable_prefix_caching=True,  # shared Alpaca header is prefilled once
+    )
+)
+
+# Fine-tuned LoRA weights for financial Q&A, attached per request
+adapter_path = snapshot_download("achnew001/fiqa-mistral-7b-lora")
+lora_request = LoRARequest("fiqa", 1, adapter_path)
+
+# === FastAPI Setup ===
+app = FastAPI()
+
+# === Request Models ===
+class Message(BaseModel):
+    role: str
+    content: str
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: List[Message]
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 256
+    stream: Optional[bool] = False
+
+# === Chat Endpoint ===
+@app.post("/v1/chat/completions")
+async def chat(request: ChatRequest):
+    # Build prompt with polite instruction style
+    conversation = ""
+    for m in request.messages:
+        if m.role == "user":
+            conversation += (
+                "Below is an instruction that describes a task, paired with an input that provides further context. "
+                "Write a response in a helpful, polite, and conversational tone.\n\n"
+                "### Instruction:\nYou are a friendly and knowledgeable financial assistant. Respond with clarity and kindness.\n\n"
+                f"### Input:\n{m.content}\n\n"
+                "### Response:\n"
+            )
+
+    sampling_params = SamplingParams(
+        max_tokens=request.max_tokens,
+        # An explicit null falls back to the default; 0 still means greedy decoding
+        temperature=0.7 if request.temperature is None else request.temperature,
+        top_p=0.95,
+    )
+
+    # The engine batches this request with any others in flight
+    outputs = engine.generate(
+        conversation, sampling_params, str(uuid.uuid4()), lora_request=lora_request
+    )
+
+    if request.stream:
+        return stream_chat(request, outputs)
+
+    final = None
+    async for output in outputs:
+        final = output
+
+    # Return OpenAI-compatible format
+    return {
+        "id": "chatcmpl-001",
+        "object": "chat.completion",
+        "model": request.model,
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": final.outputs[0].text.strip()
+            },
+            "finish_reason": "stop"
+        }]
+    }
+
+# === Streaming Response ===
+def stream_chat(request, outputs):
+    def chunk(delta, finish_reason=None):
+        payload = {
+            "id": "chatcmpl-001",
+            "object": "chat.completion.chunk",
+            "model": request.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    # Each engine output carries the full text so far; send only the new suffix
+    async def events():
+        yield chunk({"role": "assistant"})
+        sent = 0
+        try:
+            async for output in outputs:
+                text = output.outputs[0].text
+                if len(text) > sent:
+                    yield chunk({"content": text[sent:]})
+                    sent = len(text)
+        except Exception as e:
+            yield f"data: {json.dumps({'error': {'message': str(e), 'type': 'server_error'}})}\n\n"
+            return
+        yield chunk({}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
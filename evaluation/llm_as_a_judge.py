@@ -1,9 +1,33 @@
 import os
+import json
+import asyncio
+import hashlib
+import sqlite3
+import numpy as np
 import openai
 import pandas as pd
-from tqdm import tqdm
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from tqdm.asyncio import tqdm_asyncio
+
+# === Judge Backend ===
+# Defaults to GPT-4 on the OpenAI API. For large sweeps, point JUDGE_BASE_URL at a
+# local vLLM OpenAI-compatible server running an open judge model, e.g.:
+#   python -m vllm.entrypoints.openai.api_server --model meta-llama/Meta-Llama-3-70B-Instruct \
+#       --max-num-seqs 256 --enable-prefix-caching
+# and set JUDGE_MODEL=meta-llama/Meta-Llama-3-70B-Instruct.
+JUDGE_BASE_URL = os.getenv("JUDGE_BASE_URL")
+JUDGE_MODEL = os.getenv("JUDGE_MODEL", "gpt-4")
+
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY") or ("EMPTY" if JUDGE_BASE_URL else None),
+    base_url=JUDGE_BASE_URL,
+    max_retries=0,  # tenacity below owns retries; the SDK's own would multiply them
+)
+
+# Judge calls are network-bound; cap in-flight requests to stay under rate limits.
+# A local vLLM server batches continuously, so it can take far more at once.
+MAX_CONCURRENCY = 128 if JUDGE_BASE_URL else 32
 
 # === Load dataset ===
 # question, base_response, finetuned_response
@@ -37,97 +61,181 @@ Answer A:
 Answer B:  
 {answer_b}
 
-Provide your output in **this exact format**:
-
-### Evaluation for Answer A:
-- Clarity: #
-- Accuracy: #
-- Helpfulness: #
-- Relevance: #
-
-### Evaluation for Answer B:
-- Clarity: #
-- Accuracy: #
-- Helpfulness: #
-- Relevance: #
-
-Then briefly explain your reasoning for the scores.
+Submit your scores for both answers with the `submit_scores` function,
+and briefly explain your reasoning for the scores.
 """
 
+# === Structured score schema ===
+# GPT-4 returns scores as function-call JSON, so no free-text parsing is needed
+CRITERIA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        criterion: {"type": "integer", "minimum": 1, "maximum": 5}
+        for criterion in ["clarity", "accuracy", "helpfulness", "relevance"]
+    },
+    "required": ["clarity", "accuracy", "helpfulness", "relevance"],
+}
+
+SCORE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_scores",
+        "description": "Record the evaluation scores for Answer A and Answer B.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "answer_a": CRITERIA_SCHEMA,
+                "answer_b": CRITERIA_SCHEMA,
+                "reasoning": {"type": "string"},
+            },
+            "required": ["answer_a", "answer_b", "reasoning"],
+        },
+    },
+}
+
+def is_valid_evaluation(evaluation):
+    # The tool schema isn't enforced server-side, so check keys and 1-5 integer scores
+    if not isinstance(evaluation, dict) or not isinstance(evaluation.get("reasoning"), str):
+        return False
+    for answer in ["answer_a", "answer_b"]:
+        scores = evaluation.get(answer)
+        if not isinstance(scores, dict):
+            return False
+        for criterion in CRITERIA_SCHEMA["required"]:
+            score = scores.get(criterion)
+            if not isinstance(score, int) or isinstance(score, bool) or not 1 <= score <= 5:
+                return False
+    return True
+
+# === Evaluation cache ===
+# Keyed by (judge model, question, answer A hash, answer B hash) so re-runs don't re-bill
+cache = sqlite3.connect("judge_cache.sqlite")
+cache.execute("CREATE TABLE IF NOT EXISTS evals (judge TEXT, question TEXT, a_hash TEXT, b_hash TEXT, result TEXT, PRIMARY KEY (judge, question, a_hash, b_hash))")
+
+def cache_key(question, a, b):
+    return (JUDGE_MODEL, question, hashlib.sha256(a.encode()).hexdigest(), hashlib.sha256(b.encode()).hexdigest())
+
 # === Call GPT-4 ===
-def score_with_gpt4(question, a, b):
+# Retries transient failures (429s, 5xx, connection drops, timeouts) with exponential
+# backoff; other API errors such as 400/401 fail fast instead of holding a slot
+@retry(
+    retry=retry_if_exception_type((
+        openai.RateLimitError,
+        openai.InternalServerError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+    )),
+    wait=wait_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(6),
+)
+async def create_completion(prompt):
+    return await client.chat.completions.create(
+        model=JUDGE_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an expert evaluator."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.2,
+        tools=[SCORE_TOOL],
+        tool_choice={"type": "function", "function": {"name": "submit_scores"}},
+    )
+
+async def score_with_gpt4(question, a, b, sem):
+    key = cache_key(question, a, b)
+    cached = cache.execute("SELECT result FROM evals WHERE judge = ? AND question = ? AND a_hash = ? AND b_hash = ?", key).fetchone()
+    if cached:
+        return json.loads(cached[0])
+
     prompt = build_prompt(question, a, b)
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert evaluator."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-        )
-        return response["choices"][0]["message"]["content"]
-    except Exception as e:
-        print("Error:", e)
-        return "Error"
-
-# === Parse GPT-4's structured score block ===
-import re
-
-def extract_scores(text):
-    pattern = r"(Answer [AB]):\s*- Clarity: (\d).*?- Accuracy: (\d).*?- Helpfulness: (\d).*?- Relevance: (\d)"
-    matches = re.findall(pattern, text, re.DOTALL)
-    scores = {}
-    for match in matches:
-        answer = match[0][-1]  # 'A' or 'B'
-        scores[answer] = {
-            "clarity": int(match[1]),
-            "accuracy": int(match[2]),
-            "helpfulness": int(match[3]),
-            "relevance": int(match[4])
-        }
-    return scores
+    async with sem:
+        try:
+            response = await create_completion(prompt)
+            arguments = response.choices[0].message.tool_calls[0].function.arguments
+            evaluation = json.loads(arguments)
+            if not is_valid_evaluation(evaluation):
+                raise ValueError(f"Invalid judge output: {arguments}")
+        except Exception as e:
+            # Invalid output is not cached, so a rerun asks the judge again
+            print("Error:", e)
+            return None
+
+    cache.execute("INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?)", (*key, arguments))
+    cache.commit()
+    return evaluation
 
 # === Run Evaluation ===
-results = []
+async def score_one(row, base_first, sem):
+    question = str(row["question"])
+    base = str(row["base_response"])
+    fine = str(row["finetuned_response"])
 
-for _, row in tqdm(df.iterrows(), total=len(df)):
-    question = row["question"]
-    base = row["base_response"]
-    fine = row["finetuned_response"]
-
-    # Blind test: randomly shuffle order
-    import random
-    if random.random() > 0.5:
+    # Blind test: answer order comes from a pre-shuffled, balanced assignment
+    if base_first:
         a, b = base, fine
         a_label, b_label = "base", "fine"
     else:
         a, b = fine, base
         a_label, b_label = "fine", "base"
 
-    raw_eval = score_with_gpt4(question, a, b)
-    scores = extract_scores(raw_eval)
+    evaluation = await score_with_gpt4(question, a, b, sem)
 
-    if not scores:
-        continue
+    if evaluation is None:
+        return None
 
     # Align back to original model names
-    result = {
+    scores_a, scores_b = evaluation["answer_a"], evaluation["answer_b"]
+    return {
         "question": question,
-        "raw_eval": raw_eval,
-        f"{a_label}_clarity": scores["A"]["clarity"],
-        f"{a_label}_accuracy": scores["A"]["accuracy"],
-        f"{a_label}_helpfulness": scores["A"]["helpfulness"],
-        f"{a_label}_relevance": scores["A"]["relevance"],
-        f"{b_label}_clarity": scores["B"]["clarity"],
-        f"{b_label}_accuracy": scores["B"]["accuracy"],
-        f"{b_label}_helpfulness": scores["B"]["helpfulness"],
-        f"{b_label}_relevance": scores["B"]["relevance"],
+        "reasoning": evaluation["reasoning"],
+        f"{a_label}_clarity": scores_a["clarity"],
+        f"{a_label}_accuracy": scores_a["accuracy"],
+        f"{a_label}_helpfulness": scores_a["helpfulness"],
+        f"{a_label}_relevance": scores_a["relevance"],
+        f"{b_label}_clarity": scores_b["clarity"],
+        f"{b_label}_accuracy": scores_b["accuracy"],
+        f"{b_label}_helpfulness": scores_b["helpfulness"],
+        f"{b_label}_relevance": scores_b["relevance"],
     }
 
-    results.append(result)
-
 # === Output ===
-output_df = pd.DataFrame(results)
-output_df.to_csv("gpt4_model_eval_results.csv", index=False)
-print("Evaluation complete. Results saved to gpt4_model_eval_results.csv")
+# Parquet keeps integer score columns typed and is much smaller/faster than CSV
+OUTPUT_PATH = "gpt4_model_eval_results.parquet"
+PARTIAL_PATH = "gpt4_model_eval_results.partial.parquet"  # in-progress checkpoints
+CHECKPOINT_EVERY = 50  # rows between partial writes
+
+def write_results(results, path):
+    output_df = pd.DataFrame.from_records([r for r in results if r is not None])
+    output_df.to_parquet(path, compression="snappy", index=False)
+
+async def run_evaluation():
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    # Exactly half the rows show the base answer first, in a reproducible shuffle
+    order = np.array([0, 1] * (len(df) // 2 + 1))[:len(df)]
+    np.random.default_rng(42).shuffle(order)
+
+    # Results are stored by row index so partial checkpoints keep dataset order
+    results = [None] * len(df)
+    completed = 0
+
+    # A failure on one row is recorded as None instead of aborting the whole gather
+    async def score_into(i, row):
+        nonlocal completed
+        try:
+            results[i] = await score_one(row, order[i] == 0, sem)
+        except Exception as e:
+            print(f"Error on row {i}:", e)
+        completed += 1
+        if completed % CHECKPOINT_EVERY == 0:
+            write_results(results, PARTIAL_PATH)
+
+    tasks = [score_into(i, row) for i, (_, row) in enumerate(df.iterrows())]
+    await tqdm_asyncio.gather(*tasks, total=len(tasks))
+    return results
+
+results = asyncio.run(run_evaluation())
+
+# Only a finished run produces OUTPUT_PATH; the partial checkpoint is promoted over it
+write_results(results, PARTIAL_PATH)
+os.replace(PARTIAL_PATH, OUTPUT_PATH)
+print(f"Evaluation complete. Results saved to {OUTPUT_PATH}")
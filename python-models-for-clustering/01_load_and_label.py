@@ -1,19 +1,18 @@
 """
 Loads raw bank transaction data and applies two labeling strategies:
-1. Zero-shot classification using a transformer model (BART)
+1. Zero-shot classification by nearest label embedding (MiniLM sentence embeddings)
 2. Rule-based naive labeling using keyword matching
 
 These provide both a semantic and heuristic baseline for downstream modeling.
 
 Saves:
-- checkpoint_zeroshot_10k_random.csv (zero-shot labels)
-- checkpoint_naive_10k.csv (naive keyword-based labels)
+- checkpoint_labels_10k.parquet (zero-shot and naive keyword-based labels)
 """
 
+import re
 import pandas as pd
 from kagglehub import load_dataset, KaggleDatasetAdapter
-from transformers import pipeline
-from tqdm import tqdm
+from sentence_transformers import SentenceTransformer
 import torch
 
 # Load dataset from KaggleHub
@@ -32,8 +31,10 @@ print(df.head())
 df_sampled = df.sample(n=10000, random_state=42).copy()
 
 # Zero-shot classification setup
-device = 0 if torch.cuda.is_available() else -1
-classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli", device=device)
+device = "cuda" if torch.cuda.is_available() else "cpu"
+encoder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
+if device == "cuda":
+    encoder.half()
 
 labels = [
     'Transfers', 'ATM Withdrawal', 'Bank Fees', 'Bills', 'Cash Deposit', 'Cash Withdrawal',
@@ -45,17 +46,26 @@ labels = [
     'Maintenance Fee', 'Internet Services', 'Streaming Services'
 ]
 
-# Run zero-shot classification
-def classify_row(text):
-    result = classifier(str(text), candidate_labels=labels)
-    return result['labels'][0]
+# Run zero-shot classification: embed labels and distinct descriptions once each,
+# then assign every description its most similar label with a single matmul.
+# Recurring vendor strings are common, so duplicates reuse the same prediction.
+descriptions = df_sampled['TRANSACTION DETAILS'].astype(str)
+unique = descriptions.unique()
 
-df_sampled['ZeroShotCategory'] = [
-    classify_row(row) for row in tqdm(df_sampled['TRANSACTION DETAILS'], desc="🔍 Zero-Shot Classification (10k)")
-]
+label_emb = encoder.encode(labels, convert_to_tensor=True, normalize_embeddings=True)
+desc_emb = encoder.encode(
+    unique.tolist(),
+    batch_size=256,
+    convert_to_tensor=True,
+    normalize_embeddings=True,
+    show_progress_bar=True,
+)
+
+best = (desc_emb @ label_emb.T).argmax(dim=1).cpu().numpy()
+mapping = dict(zip(unique, (labels[i] for i in best)))
+df_sampled['ZeroShotCategory'] = descriptions.map(mapping)
 
-df_sampled.to_csv("checkpoint_zeroshot_10k_random.csv", index=False)
-print("Zero-shot classification saved.")
+print("Zero-shot classification done.")
 
 # Naive rule-based categorization
 keyword_map = {
@@ -81,13 +91,22 @@ keyword_map = {
     'Miscellaneous': ['misc', 'charges']
 }
 
-def naive_label(desc):
-    desc = str(desc).lower()
-    for cat, keywords in keyword_map.items():
-        if any(word in desc for word in keywords):
-            return cat
-    return 'Other'
+# One alternation regex per category; the first matching category wins
+patterns = {cat: re.compile('|'.join(map(re.escape, kws))) for cat, kws in keyword_map.items()}
+
+def naive_label(descriptions):
+    s = descriptions.astype(str).str.lower()
+    hits = pd.DataFrame({cat: s.str.contains(pat, regex=True, na=False) for cat, pat in patterns.items()})
+    return hits.idxmax(axis=1).where(hits.any(axis=1), 'Other')
+
+df_sampled['NaiveCategory'] = naive_label(df_sampled['TRANSACTION DETAILS'])
+print("Naive categorization done.")
 
-df_sampled['NaiveCategory'] = df_sampled['TRANSACTION DETAILS'].apply(naive_label)
-df_sampled.to_csv("checkpoint_naive_10k.csv", index=False)
-print("Naive categorization saved.")
+# Single checkpoint with both label columns; Parquet keeps dtypes and loads faster than CSV
+# Keep the exact strings that were labeled; other Excel columns can mix numbers
+# and text, which pyarrow rejects, so store them as strings too
+df_sampled['TRANSACTION DETAILS'] = descriptions
+object_columns = df_sampled.select_dtypes('object').columns
+df_sampled[object_columns] = df_sampled[object_columns].astype('string')
+df_sampled.to_parquet("checkpoint_labels_10k.parquet", compression="zstd", index=False)
+print("Labels saved to checkpoint_labels_10k.parquet.")
@@ -1,44 +1,45 @@
 import sys
-import json
-import pickle
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+import joblib
+import ijson
+import orjson
+
+# Number of transactions vectorized and predicted per model call
+BATCH_SIZE = 10_000
+
+def categorize_batch(batch, model, vectorizer, out):
+    # Vectorize once per batch and write one JSON object per line
+    categories = model.predict(vectorizer.transform([t['description'] for t in batch])).tolist()
+    for transaction, category in zip(batch, categories):
+        transaction['category'] = category
+        out.write(orjson.dumps(transaction, option=orjson.OPT_APPEND_NEWLINE))
 
 def main():
     if len(sys.argv) != 4:
         print("Usage: python categorize.py <transactions_file> <model_file> <vectorizer_file>")
         sys.exit(1)
-    
+
     transactions_file = sys.argv[1]
     model_file = sys.argv[2]
     vectorizer_file = sys.argv[3]
-    
-    # Load transactions
-    with open(transactions_file, 'r') as f:
-        transactions = json.load(f)
-    
-    # Load the model and vectorizer
-    with open(model_file, 'rb') as f:
-        model = pickle.load(f)
-    
-    with open(vectorizer_file, 'rb') as f:
-        vectorizer = pickle.load(f)
-    
-    # Extract descriptions
-    descriptions = [t['description'] for t in transactions]
-    
-    # Transform descriptions using the vectorizer
-    X = vectorizer.transform(descriptions)
-    
-    # Predict categories
-    categories = model.predict(X)
-    
-    # Update transactions with predicted categories
-    for i, transaction in enumerate(transactions):
-        transaction['category'] = categories[i]
-    
-    # Output the categorized transactions
-    print(json.dumps(transactions))
+
+    # Load the model and vectorizer; uncompressed joblib files memory-map their
+    # numpy arrays, so repeated runs share pages through the OS page cache
+    model = joblib.load(model_file, mmap_mode='r')
+    vectorizer = joblib.load(vectorizer_file, mmap_mode='r')
+
+    # Stream transactions from the JSON array and output them as NDJSON,
+    # so memory stays bounded by the batch size rather than the file size
+    out = sys.stdout.buffer
+    with open(transactions_file, 'rb') as f:
+        batch = []
+        for transaction in ijson.items(f, 'item', use_float=True):
+            batch.append(transaction)
+            if len(batch) == BATCH_SIZE:
+                categorize_batch(batch, model, vectorizer, out)
+                batch = []
+        if batch:
+            categorize_batch(batch, model, vectorizer, out)
+    out.flush()
 
 if __name__ == "__main__":
     main()